@@ -5,11 +5,16 @@ epg.py
 - Download every distinct source_url (supports .xml and .xml.gz)
 - Parse programmes from all sources, handle timezone offsets correctly
 - Produce docs/epg.xml (XMLTV) containing channels + programmes for 2 days (today + next day)
+- Serialize the output per channel chunk in a process pool (optional parallel gzip to docs/epg.xml.gz)
+- Produce docs/epg-delta.xml: programmes added/removed/changed per channel since the previous epg.xml
 - Log per-source and per-channel counts
+- EPG_MEMORY_BUDGET_MB=N: bounded-memory mode (stream one source at a time, spill to temp runs)
 Requires: requests, python-dateutil, pytz
 """
-import os, io, gzip, requests
+import os, io, sys, gzip, zlib, struct, hashlib, time, heapq, pickle, tempfile, requests
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
 import pytz
 from dateutil import parser as dparser
@@ -17,6 +22,18 @@ from dateutil import parser as dparser
 # CONFIG
 CHANNELS_FILE = "channels.txt"
 OUTPUT_FILE = "docs/epg.xml"
+DELTA_FILE = "docs/epg-delta.xml"
+DELTA_VERSION = "1"
+OUTPUT_GZ_FILE = OUTPUT_FILE + ".gz"
+# EPG_WORKERS=N serialization processes (default: all cores, 1 in bounded-memory mode),
+# EPG_GZIP=1 also writes OUTPUT_GZ_FILE
+SERIALIZE_WORKERS = int(os.environ.get("EPG_WORKERS") or 0) or (os.cpu_count() or 1)
+OUTPUT_GZIP = os.environ.get("EPG_GZIP", "0") not in ("", "0")
+GZIP_LEVEL = 6
+# EPG_MEMORY_BUDGET_MB=N enables bounded-memory mode; 0 keeps every source tree in memory
+MEMORY_BUDGET_MB = int(os.environ.get("EPG_MEMORY_BUDGET_MB") or 0)
+BUFFER_FRACTION = 0.25  # share of the budget each in-memory buffer (spill, output queue) may hold
+MERGE_FAN_IN = 32  # max run files merged at once
 TZ = pytz.timezone("Asia/Ho_Chi_Minh")
 
 def log(*args, **kwargs):
@@ -143,15 +160,609 @@ def build_channelinfo_from_sources(roots):
                 continue
             if cid in info:
                 continue
-            # store element for reproduction (but copy text only)
-            dn = ch.find("display-name")
-            icon = ch.find("icon")
-            info[cid] = {
-                "display-name": dn.text.strip() if dn is not None and dn.text else cid,
-                "icon": icon.get("src") if icon is not None and icon.get("src") else None
-            }
+            info[cid] = channel_info_entry(ch, cid)
     return info
 
+def channel_info_entry(ch, cid):
+    """Copy display-name/icon text out of a source <channel> element"""
+    dn = ch.find("display-name")
+    icon = ch.find("icon")
+    return {
+        "display-name": dn.text.strip() if dn is not None and dn.text else cid,
+        "icon": icon.get("src") if icon is not None and icon.get("src") else None
+    }
+
+def select_programme(p_elem, now, end_time):
+    """Return standardized record (start, stop, children) if p_elem starts inside
+       [now, end_time), else None. children = [(tag, attrib, text)]"""
+    s_attr = p_elem.attrib.get("start","")
+    e_attr = p_elem.attrib.get("stop","")
+    s_dt = parse_dt_with_offset(s_attr)
+    if s_dt is None:
+        # skip unparseable times
+        return None
+    s_dt_vn = to_vn(s_dt)
+    if not (now <= s_dt_vn < end_time):
+        return None
+
+    # stop time: try parse stop, else estimate = start + 30m
+    stop_dt = parse_dt_with_offset(e_attr)
+    if stop_dt is None or to_vn(stop_dt) <= s_dt_vn:
+        stop_dt = s_dt + timedelta(minutes=30)
+
+    children = []
+    # copy title/desc/category etc
+    title = p_elem.find("title")
+    if title is not None and title.text and title.text.strip():
+        children.append(("title", {"lang":"vi"}, title.text.strip()))
+    else:
+        children.append(("title", {"lang":"vi"}, "Chưa có tiêu đề"))
+
+    desc = p_elem.find("desc")
+    if desc is not None and desc.text and desc.text.strip():
+        children.append(("desc", {"lang":"vi"}, desc.text.strip()))
+
+    # copy other children except title/desc
+    for child in p_elem:
+        if child.tag in ("title","desc"):
+            continue
+        children.append((child.tag, dict(child.attrib), child.text or None))
+
+    return (format_output_time(s_dt), format_output_time(stop_dt), children)
+
+def build_channel_element(chan):
+    """chan: {"id", "name", "icon"} -> <channel> element"""
+    ch_el = ET.Element("channel", id=chan["id"])
+    dn = ET.SubElement(ch_el, "display-name", {"lang":"vi"})
+    dn.text = chan["name"]
+    if chan.get("icon"):
+        ET.SubElement(ch_el, "icon", {"src": chan["icon"]})
+    return ch_el
+
+def build_programme_element(cid, record):
+    start, stop, children = record
+    prog = ET.Element("programme", {"start": start, "stop": stop, "channel": cid})
+    for tag, attrib, text in children:
+        c = ET.SubElement(prog, tag, attrib)
+        c.text = text
+    return prog
+
+def deflate_block(data, final=False):
+    """Raw deflate of data ending on a byte boundary (Z_SYNC_FLUSH), so independently
+       compressed blocks can be concatenated into one stream (pigz-style).
+       The last block of the stream must be final=True."""
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def serialize_chunk(chunk, compress=False):
+    """Serialize a list of (chan, records) as indented top-level <tv> children.
+       Returns (utf-8 bytes, raw deflate block or None). Runs in worker processes."""
+    parts = []
+    for chan, records in chunk:
+        elems = [build_channel_element(chan)]
+        elems.extend(build_programme_element(chan["id"], r) for r in records)
+        for el in elems:
+            ET.indent(el, space="  ", level=1)
+            parts.append("  " + ET.tostring(el, encoding="unicode") + "\n")
+    data = "".join(parts).encode("utf-8")
+    return data, (deflate_block(data) if compress else None)
+
+def iter_chunks(channel_items, target, max_bytes=None):
+    """Group consecutive (chan, records) into chunks of about `target` elements (and at most
+       about max_bytes of records, when given). Yields (chunk, approx bytes or 0)."""
+    cur, size, nbytes = [], 0, 0
+    for item in channel_items:
+        cur.append(item)
+        size += len(item[1]) + 1
+        if max_bytes:
+            nbytes += approx_size(item)
+        if size >= target or (max_bytes and nbytes >= max_bytes):
+            yield cur, nbytes
+            cur, size, nbytes = [], 0, 0
+    if cur:
+        yield cur, nbytes
+
+def open_pool(workers):
+    if workers <= 1:
+        return None
+    try:
+        return ProcessPoolExecutor(max_workers=workers)
+    except (OSError, NotImplementedError) as e:
+        log(f"[!] Cannot start process pool ({e}), serializing in a single process")
+        return None
+
+def open_replacement(path):
+    """Temp file next to path; commit with os.replace so readers never see a partial file"""
+    d = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=d, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    os.chmod(tmp, 0o644)
+    return os.fdopen(fd, "wb"), tmp
+
+def write_output(channel_items, attrib, path=OUTPUT_FILE, gz_path=None, workers=SERIALIZE_WORKERS,
+                 size_hint=0, max_inflight=None):
+    """Write XMLTV <tv attrib> with channel_items [(chan, records)] in the given order.
+       channel_items may be a generator; it is consumed chunk by chunk (size_hint = expected
+       number of channels + programmes, used to size ~workers*4 chunks). Chunks are serialized
+       (and deflated) in a process pool with a bounded number in flight, then written in order;
+       gz_path gets one gzip member whose header/CRC32/size are added here. max_inflight
+       (bytes) also caps chunk size and the records queued in the pool (bounded-memory mode).
+       Files are replaced only when everything succeeded. Returns the number of processes used."""
+    tv = ET.tostring(ET.Element("tv", attrib), encoding="unicode", short_empty_elements=False)
+    head = ("<?xml version='1.0' encoding='utf-8'?>\n" + tv[:-len("</tv>")] + "\n").encode("utf-8")
+    tail = b"</tv>"
+
+    # each queued chunk is held twice (records in, text out): keep 2 * workers * chunk <= budget
+    max_chunk = max(1, max_inflight // (4 * max(1, workers))) if max_inflight else None
+    chunks = iter_chunks(channel_items, max(1, size_hint // max(1, workers * 4)), max_chunk)
+    compress = gz_path is not None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f, tmp = open_replacement(path)
+    gz, gz_tmp = open_replacement(gz_path) if compress else (None, None)
+    crc, size = 0, 0
+    used = 1
+    try:
+        def emit(data, block):
+            nonlocal crc, size
+            f.write(data)
+            if gz is not None:
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                gz.write(block)
+
+        if gz is not None:
+            # gzip header: deflate, no flags, mtime 0, unknown OS
+            gz.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+        emit(head, deflate_block(head) if compress else None)
+        pool = open_pool(workers)
+        if pool is None:
+            for chunk, _ in chunks:
+                emit(*serialize_chunk(chunk, compress))
+        else:
+            used = workers
+            with pool:
+                pending = deque()
+                inflight = 0
+                for chunk, nbytes in chunks:
+                    pending.append((pool.submit(serialize_chunk, chunk, compress), nbytes))
+                    inflight += nbytes
+                    del chunk
+                    while pending and (len(pending) >= workers * 2 or
+                                       (max_inflight and inflight > max_inflight // 2)):
+                        fut, nbytes = pending.popleft()
+                        emit(*fut.result())
+                        inflight -= nbytes
+                while pending:
+                    emit(*pending.popleft()[0].result())
+        emit(tail, deflate_block(tail, final=True) if compress else None)
+        if gz is not None:
+            gz.write(struct.pack("<II", crc & 0xffffffff, size & 0xffffffff))
+            gz.close()
+        f.close()
+    except BaseException:
+        for fh, t in ((f, tmp), (gz, gz_tmp)):
+            if fh is not None:
+                fh.close()
+                os.remove(t)
+        raise
+    os.replace(tmp, path)
+    if compress:
+        os.replace(gz_tmp, gz_path)
+    return used
+
+def approx_size(obj):
+    """Rough in-memory size in bytes of records made of tuples/lists/dicts/str/bytes"""
+    if isinstance(obj, (str, bytes)):
+        return 50 + len(obj)
+    if isinstance(obj, (tuple, list)):
+        return 56 + sum(8 + approx_size(o) for o in obj)
+    if isinstance(obj, dict):
+        return 232 + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    return 32
+
+def new_spill(spill_dir, key, limit=None):
+    """Sorted item buffer that writes sorted run files to spill_dir once it holds about
+       `limit` bytes (None: never spill). Feed with spill_add, read back with spill_iter."""
+    return {"dir": spill_dir, "key": key, "limit": limit, "buf": [], "size": 0, "runs": []}
+
+def spill_add(sp, item):
+    sp["buf"].append(item)
+    if sp["limit"] is not None:
+        sp["size"] += approx_size(item)
+        if sp["size"] >= sp["limit"]:
+            spill_flush(sp)
+
+def spill_flush(sp):
+    if sp["buf"]:
+        sp["runs"].append(write_run(sorted(sp["buf"], key=sp["key"]), sp["dir"]))
+        sp["buf"].clear()
+    sp["size"] = 0
+
+def spill_discard(sp):
+    for path in sp["runs"]:
+        os.remove(path)
+    sp["runs"].clear()
+    sp["buf"].clear()
+    sp["size"] = 0
+
+def spill_iter(sp):
+    """All items in key order: in-memory sort if nothing spilled, else a merge of the runs
+       with at most MERGE_FAN_IN files open (extra passes merge groups into longer runs)"""
+    if not sp["runs"]:
+        items = sorted(sp["buf"], key=sp["key"])
+        sp["buf"].clear()
+        return iter(items)
+    spill_flush(sp)
+    runs = sp["runs"]
+    while len(runs) > MERGE_FAN_IN:
+        merged = []
+        for i in range(0, len(runs), MERGE_FAN_IN):
+            group = runs[i:i + MERGE_FAN_IN]
+            merged.append(write_run(heapq.merge(*(read_run(p) for p in group), key=sp["key"]), sp["dir"]))
+            for path in group:
+                os.remove(path)
+        runs = merged
+    sp["runs"] = []
+    return heapq.merge(*(read_run(p, remove=True) for p in runs), key=sp["key"])
+
+def write_run(items, spill_dir):
+    """Write already sorted items as one run file, return its path"""
+    fd, path = tempfile.mkstemp(suffix=".run", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        for item in items:
+            pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+def read_run(path, remove=False):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+    if remove:
+        os.remove(path)
+
+def iter_top_level(source):
+    """iterparse source and yield each direct child of the root once it is complete,
+       clearing it afterwards so only one top-level element is in memory at a time"""
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            yield elem
+            # release the element: nothing keeps a reference to it after this
+            root.clear()
+
+def programme_key(channel, k, start, n):
+    """Hashed identity of a programme: the n-th programme starting at `start` in the
+       k-th block of `channel` (k > 0 only when channels.txt repeats the id)"""
+    return hashlib.blake2b(f"{channel}\x00{k}\x00{start}\x00{n}".encode("utf-8"), digest_size=8).digest()
+
+def programme_digest(stop, children):
+    """Hash of a programme's content (stop + children [(tag, attrib, text)])"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update((stop or "").encode("utf-8"))
+    for tag, attrib, text in children:
+        h.update(b"\x00" + tag.encode("utf-8"))
+        for k, v in sorted(attrib.items()):
+            h.update(f"\x01{k}={v}".encode("utf-8"))
+        h.update(b"\x02" + (text or "").encode("utf-8"))
+    return h.digest()
+
+def set_hash_add(acc, key, digest):
+    """Order-independent hash of a programme set: sum of sha256(key + digest) mod 2**256"""
+    return (acc + int.from_bytes(hashlib.sha256(key + digest).digest(), "big")) % (1 << 256)
+
+def set_hash_hex(acc):
+    return f"{acc:064x}"
+
+def key_records(cid, records, blocks):
+    """Return [(key, record)] for one channel block. blocks counts the blocks of each
+       channel id seen so far, so a repeated id in channels.txt gets distinct keys."""
+    k = blocks.get(cid, 0)
+    blocks[cid] = k + 1
+    occurrences = {}
+    keyed = []
+    for record in records:
+        n = occurrences.get(record[0], 0)
+        occurrences[record[0]] = n + 1
+        keyed.append((programme_key(cid, k, record[0], n), record))
+    return keyed
+
+def new_delta(spill_dir, limit=None):
+    """State for diffing the new programmes: new = spill of (key, digest, channel, start,
+       record) sorted by key, hash = set hash accumulator, blocks for key_records"""
+    return {"new": new_spill(spill_dir, lambda item: item[0], limit), "blocks": {}, "hash": 0}
+
+def load_previous_output(delta, path=OUTPUT_FILE):
+    """Stream the previous epg.xml (if any), keyed exactly like key_records(), into
+       delta["old"] (spill of (key, digest, channel, start) sorted by key).
+       Returns the set hash hex of its programmes, or "" if there is none."""
+    old = new_spill(delta["new"]["dir"], lambda item: item[0], delta["new"]["limit"])
+    delta["old"] = old
+    if not os.path.exists(path):
+        return ""
+    acc = 0
+    blocks, k, occurrences = {}, 0, {}
+    try:
+        for el in iter_top_level(path):
+            if el.tag == "channel":
+                # programmes follow their <channel> element in our own output
+                cid = el.get("id", "")
+                k = blocks.get(cid, 0)
+                blocks[cid] = k + 1
+                occurrences = {}
+                continue
+            if el.tag != "programme":
+                continue
+            ch = el.get("channel", "")
+            start = el.get("start", "")
+            n = occurrences.get(start, 0)
+            occurrences[start] = n + 1
+            key = programme_key(ch, k, start, n)
+            digest = programme_digest(el.get("stop", ""), [(c.tag, c.attrib, c.text) for c in el])
+            spill_add(old, (key, digest, ch, start))
+            acc = set_hash_add(acc, key, digest)
+    except Exception as e:
+        log(f"[!] Cannot read previous output {path}: {e}")
+        spill_discard(old)
+        return ""
+    if old["runs"]:
+        spill_flush(old)
+    return set_hash_hex(acc)
+
+def diff_channels(channel_items, delta):
+    """Pass-through generator over [(chan, records)] that hashes every programme into
+       delta (see new_delta). Call write_delta() once it is exhausted."""
+    for chan, records in channel_items:
+        ch = chan["id"]
+        for key, record in key_records(ch, records, delta["blocks"]):
+            start, stop, children = record
+            digest = programme_digest(stop, children)
+            delta["hash"] = set_hash_add(delta["hash"], key, digest)
+            spill_add(delta["new"], (key, digest, ch, start, record))
+        yield chan, records
+
+def join_delta(delta):
+    """Merge-join old and new programmes by key.
+       Yields (channel, kind, start, key, record) with kind 0 added, 1 changed, 2 removed."""
+    old = spill_iter(delta["old"])
+    new = spill_iter(delta["new"])
+    o = next(old, None)
+    n = next(new, None)
+    while o is not None or n is not None:
+        if o is None or (n is not None and n[0] < o[0]):
+            yield (n[2], 0, n[3], n[0], n[4])
+            n = next(new, None)
+        elif n is None or o[0] < n[0]:
+            yield (o[2], 2, o[3], o[0], None)
+            o = next(old, None)
+        else:
+            if o[1] != n[1]:
+                yield (n[2], 1, n[3], n[0], n[4])
+            o = next(old, None)
+            n = next(new, None)
+
+DELTA_KINDS = ("added", "changed", "removed")
+
+def write_delta(delta, base_hash, path=DELTA_FILE):
+    """Write delta as XML (format documented for clients in README.md). Every programme carries key = hex of
+       blake2b-64("<channel>\\0<k>\\0<start>\\0<n>"), where n counts earlier programmes with
+       the same start in the same channel block and k counts earlier blocks of that channel id.
+       base-hash/hash are set hashes over the programme contents, not over file bytes:
+       sum of sha256(key + blake2b-128 content digest, see programme_digest) mod 2**256.
+       A client whose programme set hashes to base-hash (e.g. it last applied a delta with
+       hash == base-hash) can apply this one; anyone else re-downloads the full file.
+       Entries are sorted through a spill, so this streams in bounded memory.
+       Returns (added, changed, removed, channels) counts."""
+    out = new_spill(delta["new"]["dir"], lambda item: item[:4], delta["new"]["limit"])
+    if base_hash:
+        for item in join_delta(delta):
+            spill_add(out, item)
+    counts = [0, 0, 0]
+    channels = 0
+    tv = ET.tostring(ET.Element("tv-delta", {
+        "version": DELTA_VERSION,
+        "base-hash": base_hash,
+        "hash": set_hash_hex(delta["hash"]),
+        "full": os.path.basename(OUTPUT_FILE),
+        "generator-info-name": "my-epg"
+    }), encoding="unicode", short_empty_elements=False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f, tmp = open_replacement(path)
+    try:
+        f.write(("<?xml version='1.0' encoding='utf-8'?>\n" + tv[:-len("</tv-delta>")] + "\n").encode("utf-8"))
+        cur_ch, cur_kind = None, None
+        for ch, kind, start, key, record in spill_iter(out):
+            if ch != cur_ch:
+                if cur_ch is not None:
+                    f.write(f"    </{DELTA_KINDS[cur_kind]}>\n  </channel>\n".encode("utf-8"))
+                ch_el = ET.tostring(ET.Element("channel", id=ch), encoding="unicode", short_empty_elements=False)
+                f.write(("  " + ch_el[:-len("</channel>")] + "\n").encode("utf-8"))
+                cur_ch, cur_kind = ch, None
+                channels += 1
+            if kind != cur_kind:
+                if cur_kind is not None:
+                    f.write(f"    </{DELTA_KINDS[cur_kind]}>\n".encode("utf-8"))
+                f.write(f"    <{DELTA_KINDS[kind]}>\n".encode("utf-8"))
+                cur_kind = kind
+            if record is None:
+                prog = ET.Element("programme", {"start": start, "channel": ch, "key": key.hex()})
+            else:
+                prog = build_programme_element(ch, record)
+                prog.set("key", key.hex())
+            ET.indent(prog, space="  ", level=3)
+            f.write(("      " + ET.tostring(prog, encoding="unicode") + "\n").encode("utf-8"))
+            counts[kind] += 1
+        if cur_ch is not None:
+            f.write(f"    </{DELTA_KINDS[cur_kind]}>\n  </channel>\n".encode("utf-8"))
+        f.write(b"</tv-delta>")
+        f.close()
+    except BaseException:
+        f.close()
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return counts[0], counts[1], counts[2], channels
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc, else peak as approximation)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except Exception:
+        return peak_rss_mb()
+
+def peak_rss_mb(children=False):
+    """Peak RSS in MB of this process (or its largest finished child); 0 without the
+       Unix-only resource module"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    r = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KB elsewhere
+    return r / (1 << 20) if sys.platform == "darwin" else r / 1024
+
+def open_source_stream(url):
+    """Like fetch_source, but return (file object streaming the decompressed body, response).
+       The caller closes both: GzipFile does not close the body it wraps."""
+    log(f"=> Downloading (stream): {url}")
+    r = None
+    try:
+        r = requests.get(url, timeout=60, stream=True)
+        r.raise_for_status()
+        # let urllib3 undo Content-Encoding: gzip; urllib3 2.x otherwise closes raw at EOF,
+        # and BufferedReader's next read then fails with "read of closed file"
+        r.raw.decode_content = True
+        r.raw.auto_close = False
+        body = io.BufferedReader(r.raw, buffer_size=1 << 16)
+        # .gz files served without Content-Encoding are still compressed here
+        if body.peek(2)[:2] == b"\x1f\x8b":
+            return gzip.GzipFile(fileobj=body), r
+        return body, r
+    except Exception as e:
+        log(f"[!] Error downloading {url}: {e}")
+        if r is not None:
+            r.close()
+        return None, None
+
+def extract_source_bounded(url, wanted, now, end_time, progs, seq):
+    """Stream one source, keep only programmes of wanted channels inside the window.
+       wanted: channel_id -> [index in channels.txt]. Elements are dropped as soon as they
+       are read; kept (chan_idx, seq, record) items go through a spill with the same limit
+       as progs, whose runs are handed to progs once the whole source parsed.
+       Returns (channel_info, counts, next seq) or None if the source failed."""
+    stream, resp = open_source_stream(url)
+    if stream is None:
+        log(f"   [!] No data from {url}")
+        return None
+    src = new_spill(progs["dir"], progs["key"], progs["limit"])
+    info, counts = {}, {}
+    try:
+        for elem in iter_top_level(stream):
+            if elem.tag == "programme":
+                cid = elem.attrib.get("channel","")
+                if cid in wanted:
+                    record = select_programme(elem, now, end_time)
+                    if record is not None:
+                        for idx in wanted[cid]:
+                            spill_add(src, (idx, seq, record))
+                            counts[idx] = counts.get(idx, 0) + 1
+                        seq += 1
+            elif elem.tag == "channel":
+                cid = elem.get("id")
+                if cid in wanted and cid not in info:
+                    info[cid] = channel_info_entry(elem, cid)
+        spill_flush(src)
+    except Exception as e:
+        log(f"   [!] Parse failed for {url}: {e}")
+        spill_discard(src)
+        return None
+    finally:
+        stream.close()
+        resp.close()
+    progs["runs"].extend(src["runs"])
+    log(f"   -> Parsed ({len(src['runs'])} runs, RSS {current_rss_mb():.0f} MB)")
+    return info, counts, seq
+
+def group_channels(items, chan_list):
+    """(chan_idx, seq, record) items sorted by (chan_idx, seq) -> (chan, records) for every
+       channel in chan_list order"""
+    nxt = next(items, None)
+    for idx, chan in enumerate(chan_list):
+        records = []
+        while nxt is not None and nxt[0] == idx:
+            records.append(nxt[2])
+            nxt = next(items, None)
+        yield chan, records
+
+def make_channel(ch, channel_info):
+    """channels.txt entry -> {"id", "name", "icon"} for the output <channel>"""
+    cid = ch["id"]
+    cname = ch["name"]
+    # use display-name from channels.txt; fallback to source info; icon from source (optional)
+    return {
+        "id": cid,
+        "name": cname if cname else (channel_info.get(cid,{}).get("display-name", cid)),
+        "icon": channel_info.get(cid,{}).get("icon")
+    }
+
+def select_in_memory(channels, source_urls, now, end_time):
+    """Parse every source into memory. Returns ([(chan, records)], counts) or None"""
+    roots = collect_all_from_sources(source_urls)
+    if not roots:
+        return None
+
+    # build indexes
+    prog_index = build_program_index(roots)
+    channel_info = build_channelinfo_from_sources(roots)
+
+    channel_items = []
+    # process each channel defined in channels.txt (preserve order)
+    for ch in channels:
+        records = []
+        # parse and filter by time window
+        for p_elem, src in prog_index.get(ch["id"], []):
+            record = select_programme(p_elem, now, end_time)
+            if record is not None:
+                records.append(record)
+        channel_items.append((make_channel(ch, channel_info), records))
+    return channel_items, [len(records) for _, records in channel_items]
+
+def select_bounded(channels, source_urls, now, end_time, spill_dir, limit):
+    """Stream sources one at a time, spilling to spill_dir in runs of about `limit` bytes.
+       Returns (generator of (chan, records), counts) or None"""
+    wanted = {}
+    for idx, ch in enumerate(channels):
+        wanted.setdefault(ch["id"], []).append(idx)
+
+    progs = new_spill(spill_dir, lambda item: (item[0], item[1]), limit)
+    channel_info, counts = {}, [0] * len(channels)
+    seq = 0
+    ok = 0
+    for url in source_urls:
+        res = extract_source_bounded(url, wanted, now, end_time, progs, seq)
+        if res is None:
+            continue
+        src_info, src_counts, seq = res
+        ok += 1
+        for cid, entry in src_info.items():
+            channel_info.setdefault(cid, entry)
+        for idx, cnt in src_counts.items():
+            counts[idx] += cnt
+    if not ok:
+        return None
+    log(f"=> Spilled {sum(counts)} programmes to {len(progs['runs'])} runs in {spill_dir}")
+    chan_list = [make_channel(ch, channel_info) for ch in channels]
+    return group_channels(spill_iter(progs), chan_list), counts
+
 def main():
     log("=== BẮT ĐẦU SINH EPG (multi-source, 2 ngày) ===")
     channels = read_channels()
@@ -166,107 +777,57 @@ def main():
         if url not in source_urls:
             source_urls.append(url)
 
-    # fetch all sources
-    roots = collect_all_from_sources(source_urls)
-    if not roots:
-        log("[!] No sources parsed successfully. Exiting.")
-        return
-
-    # build indexes
-    prog_index = build_program_index(roots)
-    channel_info = build_channelinfo_from_sources(roots)
-
     # time window: now .. now+2days
     now = datetime.now(TZ)
     end_time = now + timedelta(days=2)
     log(f"=> Window (VN): {now.strftime('%Y-%m-%d %H:%M:%S')} -> {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-    # build output root
-    out_root = ET.Element("tv", {
-        "generator-info-name": "my-epg",
-        "source-info-name": "multi",
-        "source-info-url": ",".join(source_urls)
-    })
-
-    total = 0
-    stats = []
-
-    # process each channel defined in channels.txt (preserve order)
-    for ch in channels:
-        cid = ch["id"]
-        cname = ch["name"]
-        # add channel element (use display-name from channels.txt; fallback to source info)
-        ch_el = ET.SubElement(out_root, "channel", id=cid)
-        dn = ET.SubElement(ch_el, "display-name", {"lang":"vi"})
-        dn.text = cname if cname else (channel_info.get(cid,{}).get("display-name", cid))
-        # add icon if available from source info (optional)
-        icon_url = channel_info.get(cid,{}).get("icon")
-        if icon_url:
-            ET.SubElement(ch_el, "icon", {"src": icon_url})
-
-        matched = 0
-        items = prog_index.get(cid, [])
-        # parse and filter by time window
-        for p_elem, src in items:
-            s_attr = p_elem.attrib.get("start","")
-            e_attr = p_elem.attrib.get("stop","")
-            s_dt = parse_dt_with_offset(s_attr)
-            if s_dt is None:
-                # skip unparseable times
-                continue
-            s_dt_vn = to_vn(s_dt)
-            if not (now <= s_dt_vn < end_time):
-                continue
-
-            # stop time: try parse stop, else estimate = start + 30m
-            stop_dt = parse_dt_with_offset(e_attr)
-            if stop_dt is None or to_vn(stop_dt) <= s_dt_vn:
-                stop_dt = s_dt + timedelta(minutes=30)
-
-            # build programme element standardized
-            prog = ET.SubElement(out_root, "programme", {
-                "start": format_output_time(s_dt),
-                "stop": format_output_time(stop_dt),
-                "channel": cid
-            })
-            # copy title/desc/category etc
-            title = p_elem.find("title")
-            if title is not None and title.text and title.text.strip():
-                t = ET.SubElement(prog, "title", {"lang":"vi"})
-                t.text = title.text.strip()
-            else:
-                t = ET.SubElement(prog, "title", {"lang":"vi"})
-                t.text = "Chưa có tiêu đề"
-
-            desc = p_elem.find("desc")
-            if desc is not None and desc.text and desc.text.strip():
-                d = ET.SubElement(prog, "desc", {"lang":"vi"})
-                d.text = desc.text.strip()
-
-            # copy other children except title/desc
-            for child in p_elem:
-                if child.tag in ("title","desc"):
-                    continue
-                newc = ET.SubElement(prog, child.tag, child.attrib)
-                if child.text:
-                    newc.text = child.text
+    # bounded mode: each spill buffer / the output queue may hold this many bytes, and
+    # serialization stays in this process unless EPG_WORKERS asks for (budgeted) workers
+    limit = int(MEMORY_BUDGET_MB * (1 << 20) * BUFFER_FRACTION) if MEMORY_BUDGET_MB else None
+    workers = 1 if MEMORY_BUDGET_MB and not os.environ.get("EPG_WORKERS") else SERIALIZE_WORKERS
+    with tempfile.TemporaryDirectory(prefix="epg-spill-") as spill_dir:
+        if MEMORY_BUDGET_MB:
+            log(f"=> Bounded-memory mode: budget {MEMORY_BUDGET_MB} MB")
+            selected = select_bounded(channels, source_urls, now, end_time, spill_dir, limit)
+        else:
+            selected = select_in_memory(channels, source_urls, now, end_time)
+        if selected is None:
+            log("[!] No sources parsed successfully. Exiting.")
+            return
+        channel_items, counts = selected
 
-            matched += 1
-            total += 1
+        total = sum(counts)
+        stats = []
+        for ch, matched in zip(channels, counts):
+            stats.append((ch["id"], ch["name"], matched))
+            log(f"   - matched {matched} programmes for {ch['id']} ({ch['name']})")
 
-        stats.append((cid, cname, matched))
-        log(f"   - matched {matched} programmes for {cid} ({cname})")
+        # diff against previous run (while streaming the new one) before overwriting it
+        delta = new_delta(spill_dir, limit)
+        base_hash = load_previous_output(delta, OUTPUT_FILE)
 
-    # pretty indent
-    try:
-        ET.indent(out_root, space="  ")
-    except Exception:
-        pass
+        # write output (serialized per channel chunk across cores)
+        t0 = time.perf_counter()
+        used = write_output(diff_channels(channel_items, delta), {
+            "generator-info-name": "my-epg",
+            "source-info-name": "multi",
+            "source-info-url": ",".join(source_urls)
+        }, OUTPUT_FILE, OUTPUT_GZ_FILE if OUTPUT_GZIP else None, workers,
+           size_hint=total + len(channels), max_inflight=limit)
+        log(f"-> written {OUTPUT_FILE} ({total} programmes, {time.perf_counter() - t0:.2f}s, {used} workers)")
+        if OUTPUT_GZIP:
+            log(f"-> written {OUTPUT_GZ_FILE}")
 
-    # write output
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    ET.ElementTree(out_root).write(OUTPUT_FILE, encoding="utf-8", xml_declaration=True)
-    log(f"-> written {OUTPUT_FILE} ({total} programmes)")
+        # write delta (full file stays the fallback when base-hash does not match)
+        added, changed, removed, n_channels = write_delta(delta, base_hash)
+    if base_hash:
+        log(f"-> written {DELTA_FILE} (+{added} ~{changed} -{removed} in {n_channels} channels)")
+        # same programme set must mean an empty delta, or keys are not unique
+        if base_hash == set_hash_hex(delta["hash"]) and (added or changed or removed):
+            log("[!] Delta is not empty although the programme set is unchanged")
+    else:
+        log(f"-> written {DELTA_FILE} (no previous {OUTPUT_FILE}, clients use full file)")
 
     # summary
     log("\n=== SUMMARY ===")
@@ -274,6 +835,15 @@ def main():
     for cid, cname, cnt in stats:
         log(f"- {cid} ({cname}): {cnt}")
     log(f"Total programmes: {total}")
+    budget = f"{MEMORY_BUDGET_MB} MB" if MEMORY_BUDGET_MB else "unbounded"
+    # workers run alongside the main process: count each at the largest worker's peak
+    main_peak = peak_rss_mb()
+    worker_peak = peak_rss_mb(children=True) if used > 1 else 0.0
+    peak = main_peak + worker_peak * (used if used > 1 else 0)
+    log(f"Peak memory: {peak:.0f} MB ({main_peak:.0f} MB main + {used if used > 1 else 0} x "
+        f"{worker_peak:.0f} MB workers, budget: {budget})")
+    if MEMORY_BUDGET_MB and peak > MEMORY_BUDGET_MB:
+        log(f"[!] Peak memory {peak:.0f} MB exceeded the {MEMORY_BUDGET_MB} MB budget")
     log("=== DONE ===")
 
 if __name__ == "__main__":
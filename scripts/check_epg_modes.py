@@ -0,0 +1,109 @@
+"""
+check_epg_modes.py
+- End-to-end check of epg.py over real HTTP (no network needed)
+- Serve a generated .xml and .xml.gz source from a local http.server
+- Run epg.py in-memory, then again in bounded-memory mode (EPG_MEMORY_BUDGET_MB)
+- Both runs must parse every source and write the same docs/epg.xml; the second run's
+  delta must be empty with base-hash == hash
+
+Usage:
+    python scripts/check_epg_modes.py
+"""
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import pytz
+
+EPG_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "epg.py")
+TZ = pytz.timezone("Asia/Ho_Chi_Minh")
+CHANNELS = 30
+HOURS = 36
+
+def log(msg=""):
+    print(msg, flush=True)
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def make_source(prefix):
+    """XMLTV bytes with CHANNELS channels, hourly programmes starting 1-2h from now (well inside the window)"""
+    first = datetime.now(TZ).replace(minute=0, second=0, microsecond=0) + timedelta(hours=2)
+    tv = ET.Element("tv")
+    for c in range(CHANNELS):
+        ch = ET.SubElement(tv, "channel", id=f"{prefix}{c}")
+        ET.SubElement(ch, "display-name").text = f"{prefix.upper()} {c} HD"
+    for c in range(CHANNELS):
+        for i in range(HOURS):
+            start = (first + timedelta(hours=i)).astimezone(pytz.utc)
+            p = ET.SubElement(tv, "programme", {
+                "start": start.strftime("%Y%m%d%H%M%S +0000"),
+                "stop": (start + timedelta(hours=1)).strftime("%Y%m%d%H%M%S +0000"),
+                "channel": f"{prefix}{c}",
+            })
+            ET.SubElement(p, "title").text = f"Show {c}-{i} & <{prefix}>"
+            ET.SubElement(p, "desc").text = f"Mô tả {i}"
+    return ET.tostring(tv, encoding="utf-8", xml_declaration=True)
+
+def run_epg(workdir, env_extra):
+    res = subprocess.run([sys.executable, os.path.abspath(EPG_PY)], cwd=workdir,
+                         env=dict(os.environ, **env_extra), capture_output=True, text=True, timeout=600)
+    out = res.stdout + res.stderr
+    # budget warnings are expected with a tiny budget; any other [!] is a failure
+    bad = [ln for ln in out.splitlines() if "[!]" in ln and "exceeded the" not in ln]
+    if res.returncode != 0 or bad:
+        log(out)
+        raise SystemExit(f"[!] epg.py failed ({env_extra}): {bad or res.returncode}")
+    return out
+
+def main():
+    serve_dir = tempfile.mkdtemp(prefix="epg-check-src-")
+    workdir = tempfile.mkdtemp(prefix="epg-check-run-")
+    server = HTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=serve_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with open(os.path.join(serve_dir, "plain.xml"), "wb") as f:
+            f.write(make_source("pl"))
+        with open(os.path.join(serve_dir, "packed.xml.gz"), "wb") as f:
+            f.write(gzip.compress(make_source("gz")))
+        with open(os.path.join(workdir, "channels.txt"), "w", encoding="utf-8") as f:
+            for c in range(CHANNELS):
+                f.write(f"pl{c} | {base}/plain.xml | PL {c}\n")
+                f.write(f"gz{c} | {base}/packed.xml.gz | GZ {c}\n")
+        expected = 2 * CHANNELS * HOURS
+
+        log("=> epg.py (in-memory)")
+        out = run_epg(workdir, {})
+        if f"Total programmes: {expected}" not in out:
+            raise SystemExit(f"[!] in-memory run did not produce {expected} programmes")
+        with open(os.path.join(workdir, "docs", "epg.xml"), "rb") as f:
+            in_memory = f.read()
+
+        log("=> epg.py (EPG_MEMORY_BUDGET_MB=8, streamed HTTP sources)")
+        out = run_epg(workdir, {"EPG_MEMORY_BUDGET_MB": "8"})
+        if f"Total programmes: {expected}" not in out:
+            raise SystemExit(f"[!] bounded run did not produce {expected} programmes")
+        with open(os.path.join(workdir, "docs", "epg.xml"), "rb") as f:
+            if f.read() != in_memory:
+                raise SystemExit("[!] bounded-memory output differs from in-memory output")
+
+        delta = ET.parse(os.path.join(workdir, "docs", "epg-delta.xml")).getroot()
+        if len(delta) or not delta.get("base-hash") or delta.get("base-hash") != delta.get("hash"):
+            raise SystemExit("[!] delta of an unchanged re-run is not empty")
+        log(f"-> OK: {expected} programmes, identical output, empty delta")
+    finally:
+        server.shutdown()
+        shutil.rmtree(serve_dir, ignore_errors=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+resolve_channel_ids.py
+- Build an index over every channel id + display-name from nguonlps.txt and channels.txt sources
+- Index = normalized name -> entries, plus trigram -> normalized names (inverted)
+- For ids in channels.txt / m3u that get no programmes (epg.py takes an id's programmes
+  from every source), print ranked candidates
+- Write the audit to docs/unmatched_channels.txt (channels whose source failed are listed apart)
+
+Usage:
+    python scripts/resolve_channel_ids.py              # audit channels.txt + m3u
+    python scripts/resolve_channel_ids.py "TNT Sports 1" angiang2test   # look up names
+"""
+import os
+import re
+import sys
+import time
+import heapq
+import unicodedata
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import pytz
+from colorama import Fore, Style, init
+
+# works both as `python scripts/resolve_channel_ids.py` and `import scripts.resolve_channel_ids`
+try:
+    from .extract_tvg_ids import fetch_xml, log_info, log_success, log_error
+except ImportError:
+    from extract_tvg_ids import fetch_xml, log_info, log_success, log_error
+
+init(autoreset=True)
+
+OUTPUT = "docs/unmatched_channels.txt"
+SOURCE_FILE = "nguonlps.txt"
+CHANNELS_FILE = "channels.txt"
+M3U_FILE = "m3u"
+MAX_CANDIDATES = 5
+MIN_SCORE = 0.3
+
+# tokens that do not identify a channel
+NOISE_TOKENS = {"hd", "fhd", "uhd", "sd", "4k", "tv", "channel"}
+# trailing country codes seen in ids / names ('Sky Sport 1 NZ', 'TNTSports1 HD.uk')
+COUNTRY_CODES = {
+    "uk", "gb", "us", "usa", "ca", "au", "nz", "hk", "sg", "my", "th", "vn", "id", "ph",
+    "in", "pk", "de", "fr", "it", "es", "pt", "nl", "be", "ch", "at", "pl", "ro", "se",
+    "no", "dk", "fi", "ie", "tr", "ru", "ua", "ar", "br", "mx", "za", "kr", "jp", "tw",
+    "cn", "ae", "sa", "qa",
+}
+
+def normalize_name(s):
+    """'TNTSports1 HD.uk' -> 'tntsports1'; 'Sky Sport 1 NZ' -> 'skysport1';
+       'hbohd' -> 'hbo'; 'Ăn Giang 2' -> 'angiang2'"""
+    if not s:
+        return ""
+    s = s.strip().replace("đ", "d").replace("Đ", "D")
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    # split camel/digit boundaries so 'TNTSports1HD' loses its 'hd' too
+    tokens = re.findall(r"[a-z]+|[0-9]+", s)
+    # glued quality suffix: 'hbohd' -> 'hbo'
+    tokens = [re.sub(r"(?<=[a-z]{2})(?:fhd|uhd|hd|sd)$", "", t) for t in tokens]
+    # trailing country code / quality, whatever the separator ('.uk', ' NZ', '_us')
+    while len(tokens) > 1 and (tokens[-1] in COUNTRY_CODES or tokens[-1] in NOISE_TOKENS):
+        tokens.pop()
+    kept = [t for t in tokens if t not in NOISE_TOKENS]
+    return "".join(kept or tokens)
+
+def trigrams(norm):
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def build_index(entries):
+    """entries: iterable of (channel_id, display_name_or_None, source_url).
+       Returns {"names": norm -> [(id, name, src)], "grams": trigram -> [norm],
+                "sizes": norm -> trigram count}"""
+    names = {}
+    for cid, dname, src in entries:
+        for label in (cid, dname):
+            norm = normalize_name(label)
+            if not norm:
+                continue
+            bucket = names.setdefault(norm, [])
+            entry = (cid, dname, src)
+            if entry not in bucket:
+                bucket.append(entry)
+    grams = {}
+    sizes = {}
+    for norm in names:
+        gs = trigrams(norm)
+        sizes[norm] = len(gs)
+        for g in gs:
+            grams.setdefault(g, []).append(norm)
+    return {"names": names, "grams": grams, "sizes": sizes}
+
+def resolve(index, query, limit=MAX_CANDIDATES):
+    """Return up to `limit` candidates [(score, id, display-name, src)] best first.
+       Score is 1.0 for a normalized exact match, else trigram Dice coefficient."""
+    norm = normalize_name(query)
+    if not norm:
+        return []
+    q_grams = trigrams(norm)
+    counts = {}
+    for g in q_grams:
+        for other in index["grams"].get(g, ()):
+            counts[other] = counts.get(other, 0) + 1
+    scored = []
+    for other, common in counts.items():
+        if other == norm:
+            score = 1.0
+        else:
+            score = 2.0 * common / (len(q_grams) + index["sizes"][other])
+        if score >= MIN_SCORE:
+            scored.append((score, other))
+    result = []
+    for score, other in heapq.nlargest(limit, scored):
+        for cid, dname, src in index["names"][other]:
+            result.append((round(score, 3), cid, dname, src))
+    return result[:limit]
+
+def resolve_any(index, labels, limit=MAX_CANDIDATES):
+    """Resolve several labels for one channel (id, display-name), keep best score per (id, src)"""
+    best = {}
+    for label in labels:
+        for score, cid, dname, src in resolve(index, label, limit):
+            key = (cid, src)
+            if key not in best or score > best[key][0]:
+                best[key] = (score, cid, dname, src)
+    return sorted(best.values(), key=lambda c: -c[0])[:limit]
+
+def read_sources():
+    if not os.path.exists(SOURCE_FILE):
+        return []
+    with open(SOURCE_FILE, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def read_channels():
+    """Return [(id, url, display-name)] from channels.txt"""
+    chans = []
+    if not os.path.exists(CHANNELS_FILE):
+        return chans
+    with open(CHANNELS_FILE, "r", encoding="utf-8") as f:
+        for ln in f:
+            ln = ln.strip()
+            if not ln or ln.startswith("#"):
+                continue
+            parts = [p.strip() for p in ln.split("|")]
+            if len(parts) < 3:
+                continue
+            chans.append((parts[0], parts[1], parts[2]))
+    return chans
+
+def read_m3u_ids():
+    """Return [(tvg-id, title)] from the m3u playlist"""
+    ids = []
+    if not os.path.exists(M3U_FILE):
+        return ids
+    with open(M3U_FILE, "r", encoding="utf-8") as f:
+        for ln in f:
+            if not ln.startswith("#EXTINF"):
+                continue
+            m = re.search(r'tvg-id="([^"]*)"', ln)
+            if m and m.group(1).strip():
+                title = ln.rsplit(",", 1)[-1].strip() if "," in ln else ""
+                ids.append((m.group(1).strip(), title))
+    return ids
+
+def extract_channels(xml_content):
+    """Return ([(id, [display-names])], set(ids with programmes))"""
+    root = ET.fromstring(xml_content)
+    chans = []
+    for ch in root.findall("channel"):
+        cid = (ch.attrib.get("id") or "").strip()
+        if not cid:
+            continue
+        names = [dn.text.strip() for dn in ch.findall("display-name") if dn.text and dn.text.strip()]
+        chans.append((cid, names))
+    with_progs = {p.attrib.get("channel", "") for p in root.findall("programme")}
+    return chans, with_progs
+
+def load_sources(urls):
+    """Download each source once.
+       Returns (entries for build_index, url -> set(ids that have programmes))"""
+    entries = []
+    ids_by_src = {}
+    for src in urls:
+        try:
+            chans, with_progs = extract_channels(fetch_xml(src))
+        except Exception as e:
+            log_error(f"[!] Lỗi khi xử lý {src}: {e}")
+            continue
+        for cid, names in chans:
+            if not names:
+                entries.append((cid, None, src))
+            for dname in names:
+                entries.append((cid, dname, src))
+        ids_by_src[src] = with_progs
+        log_success(f"   + {len(chans)} kênh từ {src}")
+    return entries, ids_by_src
+
+def save_report(report, unavailable, elapsed_us, with_progs=None):
+    with open(OUTPUT, "w", encoding="utf-8") as f:
+        f.write("# Kênh trong channels.txt / m3u không có programme nào trong các nguồn (epg.py sẽ ra 0), kèm gợi ý\n")
+        f.write(f"# Cập nhật lúc: {datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        for origin, cid, name, candidates in report:
+            f.write(f"## {cid} ({name}) [{origin}]\n")
+            if not candidates:
+                f.write("# (không có gợi ý)\n")
+            for score, c_id, c_name, c_src in candidates:
+                f.write(f"{score:.3f} | {c_id} | {c_name or ''} | {c_src}{no_progs_note(c_id, with_progs)}\n")
+            f.write("\n")
+        if unavailable:
+            f.write("# Không kiểm tra được (nguồn tải/đọc lỗi)\n")
+            for cid, name, url in unavailable:
+                f.write(f"{cid} | {name} | {url}\n")
+            f.write("\n")
+        f.write(f"=== Không khớp: {len(report)} | Nguồn lỗi: {len(unavailable)} kênh "
+                f"| Trung bình {elapsed_us:.0f} µs/lần tra ===\n")
+    log_success(f"=> Đã lưu {len(report)} kênh không khớp vào {OUTPUT}")
+
+def no_progs_note(cid, with_progs):
+    return "" if with_progs is None or cid in with_progs else " [0 programme]"
+
+def print_candidates(query, candidates, with_progs=None):
+    print(Fore.YELLOW + f"- {query}" + Style.RESET_ALL)
+    if not candidates:
+        print("    (không có gợi ý)")
+    for score, c_id, c_name, c_src in candidates:
+        print(f"    {score:.3f}  {c_id}  ({c_name or ''})  {c_src}{no_progs_note(c_id, with_progs)}")
+
+if __name__ == "__main__":
+    channels = read_channels()
+    urls = read_sources()
+    for _, url, _ in channels:
+        if url not in urls:
+            urls.append(url)
+    if not urls:
+        log_error("[!] Không có nguồn nào trong nguonlps.txt / channels.txt.")
+        exit(1)
+
+    entries, ids_by_src = load_sources(urls)
+    t0 = time.perf_counter()
+    index = build_index(entries)
+    log_info(f"=> Index: {len(index['names'])} tên, {len(index['grams'])} trigram "
+             f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
+
+    # like epg.py: an id gets programmes from every source, so it is matched when any
+    # loaded source has programmes for it (a bare <channel> still gives 0 programmes)
+    with_progs = set().union(*ids_by_src.values()) if ids_by_src else set()
+
+    queries = sys.argv[1:]
+    if queries:
+        for q in queries:
+            print_candidates(q, resolve(index, q), with_progs)
+        exit(0)
+
+    # unmatched ids whose own source failed may be fine once it loads: list them apart
+    pending = []
+    unavailable = []
+    for cid, url, name in channels:
+        if cid in with_progs:
+            continue
+        if url not in ids_by_src:
+            unavailable.append((cid, name, url))
+        else:
+            pending.append(("channels.txt", cid, name))
+    for cid, title in read_m3u_ids():
+        if cid not in with_progs:
+            pending.append(("m3u", cid, title))
+
+    report = []
+    t0 = time.perf_counter()
+    for origin, cid, name in pending:
+        report.append((origin, cid, name, resolve_any(index, (cid, name))))
+    elapsed_us = (time.perf_counter() - t0) * 1e6 / max(len(pending), 1)
+
+    for origin, cid, name, candidates in report:
+        print_candidates(f"{cid} ({name}) [{origin}]", candidates, with_progs)
+    for cid, name, url in unavailable:
+        log_error(f"- {cid} ({name}): nguồn lỗi, bỏ qua {url}")
+    if len(ids_by_src) < len(urls):
+        log_error(f"[!] {len(urls) - len(ids_by_src)} nguồn lỗi: kết quả m3u có thể thiếu")
+    save_report(report, unavailable, elapsed_us, with_progs)
+    log_info("=== HOÀN TẤT ===")